@@ -1,7 +1,18 @@
+import importlib
 import os
+import sys
 from dotenv import load_dotenv
 
-load_dotenv() # Load variables from .env file
+# Kept across importlib.reload() so the .env file is parsed once per process
+_env_loaded = globals().get("_env_loaded", False)
+
+def _load_env():
+    global _env_loaded
+    if not _env_loaded:
+        load_dotenv() # Load variables from .env file
+        _env_loaded = True
+
+_load_env()
 
 # Rise Up API Configuration
 RISEUP_PUBLIC_KEY = os.getenv("RISEUP_PUBLIC_KEY")
@@ -17,35 +28,65 @@ LEARNINGBOX_API_ENDPOINT = os.getenv("LEARNINGBOX_API_ENDPOINT")
 WEBHOOK_BASE_URL = os.getenv("WEBHOOK_BASE_URL")
 WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/learningbox_webhook")
 WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET") # Optional secret for signature verification
+WEBHOOK_UPLOAD_WORKERS = int(os.getenv("WEBHOOK_UPLOAD_WORKERS", "8")) # Background SCORM uploads per webhook process
 
-def get_full_webhook_url():
+def _build_full_webhook_url():
     if not WEBHOOK_BASE_URL:
-        raise ValueError("WEBHOOK_BASE_URL must be set in the .env file")
+        return None
     return f"{WEBHOOK_BASE_URL.rstrip('/')}{WEBHOOK_PATH}"
 
+# Built once at import (and by config.reload()); None when WEBHOOK_BASE_URL is unset
+WEBHOOK_URL = _build_full_webhook_url()
+
+def get_full_webhook_url():
+    if not WEBHOOK_URL:
+        raise ValueError("WEBHOOK_BASE_URL must be set in the .env file")
+    return WEBHOOK_URL
+
 # LearningBox SCORM Request Defaults
 LB_REQUEST_CLIENT_ID = os.getenv("LB_REQUEST_CLIENT_ID", "001")
 LB_REQUEST_TYPE = os.getenv("LB_REQUEST_TYPE", "light")
 LB_REQUEST_FORMAT = os.getenv("LB_REQUEST_FORMAT", "scorm2004")
 LB_REQUEST_NAVIGATION = os.getenv("LB_REQUEST_NAVIGATION", "free")
 LB_REQUEST_WEBHOOK_VERB = os.getenv("LB_REQUEST_WEBHOOK_VERB", "POST")
+LB_CATALOG_CACHE_TTL = int(os.getenv("LB_CATALOG_CACHE_TTL", "300")) # Seconds to reuse a fetched catalog
 
-# Mapping file
+# Downloaded media stays in RAM up to this many bytes, then spills to a temp file
+SPOOL_MAX_MEMORY = int(os.getenv("SPOOL_MAX_MEMORY", str(8 * 1024 * 1024)))
+
+# Course images/banners larger than this are skipped rather than downloaded
+MAX_MEDIA_BYTES = int(os.getenv("MAX_MEDIA_BYTES", str(10 * 1024 * 1024)))
+
+# Client-side rate limit per API host (requests/second), lowered automatically on HTTP 429
+RATE_LIMIT_PER_SECOND = float(os.getenv("RATE_LIMIT_PER_SECOND", "10"))
+
+# Keep-alive connections per API/media host. Pools block when exhausted instead
+# of opening throwaway connections (each costing a TCP + TLS handshake), so size
+# this to the number of threads that may hit one host (SYNC_CONCURRENCY * 3).
+HTTP_POOL_MAXSIZE = int(os.getenv("HTTP_POOL_MAXSIZE", "32"))
+
+# Sync Concurrency
+SYNC_CONCURRENCY = int(os.getenv("SYNC_CONCURRENCY", "10")) # Courses synced in parallel by sync_courses.py
+
+# Mapping store (SQLite); the legacy JSON mapping file is imported on first use
+MAPPING_DB_PATH = os.getenv("MAPPING_DB_PATH", "lb_to_riseup_mapping.sqlite3")
 MAPPING_FILE_PATH = os.getenv("MAPPING_FILE_PATH", "lb_to_riseup_mapping.json")
 
 # --- Input Validation ---
+_REQUIRED = (
+    "RISEUP_PUBLIC_KEY",
+    "RISEUP_PRIVATE_KEY",
+    "RISEUP_API_ENDPOINT",
+    "RISEUP_CREATOR_USER_ID",
+    "LEARNINGBOX_API_KEY",
+    "LEARNINGBOX_API_ENDPOINT",
+    "WEBHOOK_BASE_URL",
+)
+
 def validate_config():
-    required_vars = [
-        ("RISEUP_PUBLIC_KEY", RISEUP_PUBLIC_KEY),
-        ("RISEUP_PRIVATE_KEY", RISEUP_PRIVATE_KEY),
-        ("RISEUP_API_ENDPOINT", RISEUP_API_ENDPOINT),
-        ("RISEUP_CREATOR_USER_ID", RISEUP_CREATOR_USER_ID),
-        ("LEARNINGBOX_API_KEY", LEARNINGBOX_API_KEY),
-        ("LEARNINGBOX_API_ENDPOINT", LEARNINGBOX_API_ENDPOINT),
-        ("WEBHOOK_BASE_URL", WEBHOOK_BASE_URL),
-    ]
-    missing = [name for name, value in required_vars if not value]
-    if missing:
+    settings = globals()
+    if not all(settings.get(name) for name in _REQUIRED):
+        missing = [name for name in _REQUIRED if not settings.get(name)]
         raise ValueError(f"Missing required configuration variables in .env: {', '.join(missing)}")
 
     if RISEUP_CREATOR_USER_ID == 0:
@@ -53,6 +94,13 @@ def validate_config():
 
     print("Configuration loaded successfully.")
 
+def reload():
+    """Re-reads the .env file and recomputes the settings in this module."""
+    # Variables already in os.environ take precedence over the .env file
+    global _env_loaded
+    _env_loaded = False
+    return importlib.reload(sys.modules[__name__])
+
 # You can call validate_config() when your scripts start
 # if __name__ == "__main__":
 #     try:
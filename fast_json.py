@@ -0,0 +1,30 @@
+import json
+from requests.exceptions import JSONDecodeError as ResponseJSONDecodeError
+
+try:
+    import orjson
+except ImportError: # Optional speed-up, fall back to the stdlib parser
+    orjson = None
+
+def loads(data):
+    """Parses JSON from bytes or str."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+def dumps(obj):
+    """Serializes obj to compact JSON bytes; int dict keys become strings."""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, separators=(',', ':')).encode()
+
+def parse_response(response):
+    """Drop-in for response.json() that parses the raw body bytes directly.
+
+    Decode errors are raised as requests' JSONDecodeError (a RequestException),
+    like response.json() does, so existing error handling still applies.
+    """
+    try:
+        return loads(response.content)
+    except json.JSONDecodeError as e:
+        raise ResponseJSONDecodeError(e.msg, e.doc, e.pos) from e
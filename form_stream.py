@@ -0,0 +1,112 @@
+import binascii
+import re
+from urllib.parse import unquote_to_bytes
+
+_NAME_END = re.compile(rb'[=&]')
+_BASE64_ALPHABET = b'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/='
+# Everything else is skipped, like base64.b64decode() does by default
+_BASE64_DISCARD = bytes(b for b in range(256) if b not in _BASE64_ALPHABET)
+
+def _unquote(raw):
+    return unquote_to_bytes(raw.replace(b'+', b' '))
+
+class Base64StreamDecoder:
+    """Decodes base64 text written in arbitrary pieces into a binary file."""
+    def __init__(self, out):
+        self.out = out
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self._buf = b''
+
+    def write(self, data):
+        self.bytes_in += len(data)
+        data = self._buf + data.translate(None, _BASE64_DISCARD)
+        usable = len(data) - len(data) % 4 # Only decode whole 4-character groups
+        if usable:
+            self._write_decoded(data[:usable])
+        self._buf = data[usable:]
+
+    def close(self):
+        """Decodes what is left; raises binascii.Error on truncated input."""
+        if self._buf:
+            self._write_decoded(self._buf)
+            self._buf = b''
+
+    def _write_decoded(self, data):
+        decoded = binascii.a2b_base64(data)
+        self.out.write(decoded)
+        self.bytes_out += len(decoded)
+
+def parse_urlencoded_stream(stream, sinks, chunk_size=64 * 1024):
+    """Parses an application/x-www-form-urlencoded body from a binary stream.
+
+    The value of each field named in `sinks` is URL-decoded piece by piece and
+    passed to sinks[name](bytes) instead of being kept in memory, so a large
+    field never has to be held whole. Other fields are returned as a dict of
+    lists of str, with parse_qs() semantics (blank values are dropped).
+    """
+    remaining_sinks = dict(sinks)
+    fields = {}
+    name = bytearray()
+    value = bytearray()
+    in_value = False
+    sink = None
+    pending = b'' # Tail of a streamed value that may be a split %XX escape
+
+    def feed(data):
+        nonlocal pending
+        data = pending + data
+        cut = data.rfind(b'%', max(len(data) - 2, 0))
+        if cut != -1:
+            data, pending = data[:cut], data[cut:]
+        else:
+            pending = b''
+        if data:
+            sink(_unquote(data))
+
+    def end_field():
+        nonlocal pending
+        if sink is not None:
+            if pending:
+                sink(_unquote(pending))
+                pending = b''
+        elif value:
+            key = _unquote(bytes(name)).decode('utf-8', 'replace')
+            fields.setdefault(key, []).append(_unquote(bytes(value)).decode('utf-8', 'replace'))
+
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        pos = 0
+        while pos < len(chunk):
+            if not in_value:
+                match = _NAME_END.search(chunk, pos)
+                if match is None:
+                    name += chunk[pos:]
+                    break
+                name += chunk[pos:match.start()]
+                pos = match.end()
+                if match.group() == b'&':
+                    name.clear() # Field without '=': ignored, like parse_qs
+                    continue
+                in_value = True
+                sink = remaining_sinks.pop(_unquote(bytes(name)).decode('utf-8', 'replace'), None)
+            else:
+                end = chunk.find(b'&', pos)
+                part = chunk[pos:] if end == -1 else chunk[pos:end]
+                if sink is not None:
+                    feed(part)
+                else:
+                    value += part
+                if end == -1:
+                    break
+                pos = end + 1
+                end_field()
+                name.clear()
+                value.clear()
+                in_value = False
+                sink = None
+    if in_value:
+        end_field()
+    return fields
@@ -0,0 +1,22 @@
+# Gunicorn settings for the webhook handler:
+#     gunicorn -c gunicorn_conf.py webhook_handler:app
+import os
+
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:5001")
+
+# Webhooks spend their time on network I/O (receiving the SCORM payload,
+# uploading it to Rise Up), so a few processes with many threads each let
+# parallel webhooks proceed instead of queueing behind one another.
+workers = int(os.getenv("GUNICORN_WORKERS", "2"))
+worker_class = "gthread"
+threads = int(os.getenv("GUNICORN_THREADS", "16"))
+
+# SCORM uploads can be slow
+timeout = 300
+# Uploads run in background threads after the webhook is acknowledged; give
+# them time to finish when a worker is recycled or the server stops
+graceful_timeout = 300
+
+# Recycle workers periodically to bound memory growth
+max_requests = 200
+max_requests_jitter = 20
@@ -1,49 +1,157 @@
+import logging
+import time
 import requests
 import config
+import fast_json
+from concurrent.futures import ThreadPoolExecutor
+from rate_limiter import RateLimitedAdapter
 from requests.exceptions import RequestException
 
+logger = logging.getLogger(__name__)
+
 class LearningBoxClient:
+    # Connections kept per host; also caps the threads used by bulk calls
+    POOL_MAXSIZE = config.HTTP_POOL_MAXSIZE
+    # Threads used to fetch catalog pages 2..N
+    CATALOG_PAGE_WORKERS = 8
+
     def __init__(self):
         self.base_url = config.LEARNINGBOX_API_ENDPOINT.rstrip('/')
         self.api_key = config.LEARNINGBOX_API_KEY
         # Define how the API key is sent. Assuming X-Api-Key header.
         # Change this if Learning Box uses a different method (e.g., Bearer token).
         self.auth_headers = {"X-Gravitee-Api-Key": self.api_key}
+        # Reuse one Session so keep-alive connections (and the TLS handshake)
+        # are shared across catalog/export calls.
+        self.session = requests.Session()
+        self.session.headers.update(self.auth_headers)
+        self.session.headers.update({"Accept": "application/json"})
+        self._json_headers = {"Content-Type": "application/json"}
+        # Paced per host, shared with any other client hitting the same API
+        adapter = RateLimitedAdapter(pool_maxsize=self.POOL_MAXSIZE, pool_block=True)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        # In-process catalog cache, see get_catalog()
+        self.catalog_ttl = config.LB_CATALOG_CACHE_TTL
+        self.invalidate_catalog()
 
-    def _make_request(self, method, endpoint, **kwargs):
-        """Makes a request to the Learning Box API."""
+    def close(self):
+        """Closes the underlying HTTP session and its pooled connections."""
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _log_request_error(self, method, url, e):
+        logger.error("Error during Learning Box API call (%s %s): %s", method, url, e)
+        if e.response is not None:
+            logger.error("Response status: %s", e.response.status_code)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Response body: %s", e.response.text)
+
+    def _send(self, method, endpoint, **kwargs):
+        """Sends a request to the Learning Box API and returns the checked response."""
         url = f"{self.base_url}{endpoint}"
-        headers = kwargs.pop('headers', {})
-        headers.update(self.auth_headers) # Add authentication headers
-        headers.setdefault('Accept', 'application/json')
-        if method in ('POST', 'PUT') and 'json' in kwargs and 'Content-Type' not in headers:
-            headers['Content-Type'] = 'application/json'
+        # Auth and Accept headers are set on the session
+        headers = kwargs.pop('headers', None)
+        if method in ('POST', 'PUT') and 'json' in kwargs:
+            headers = {**self._json_headers, **headers} if headers else self._json_headers
 
         try:
-            response = requests.request(method, url, headers=headers, **kwargs)
+            response = self.session.request(method, url, headers=headers, **kwargs)
             response.raise_for_status()
-            # Handle potential 204 No Content responses
-            if response.status_code == 204:
-                return None
-            return response.json()
+            return response
+        except RequestException as e:
+            self._log_request_error(method, url, e)
+            raise
+
+    def _make_request(self, method, endpoint, **kwargs):
+        """Makes a request to the Learning Box API and returns the decoded body."""
+        response = self._send(method, endpoint, **kwargs)
+        # Handle potential 204 No Content responses
+        if response.status_code == 204:
+            return None
+        try:
+            return fast_json.parse_response(response)
         except RequestException as e:
-            print(f"Error during Learning Box API call ({method} {url}): {e}")
-            if e.response is not None:
-                print(f"Response status: {e.response.status_code}")
-                print(f"Response body: {e.response.text}")
+            self._log_request_error(method, response.url, e)
             raise
 
+    def invalidate_catalog(self):
+        """Forgets the cached catalog, e.g. after changing courses in Learning Box."""
+        self._catalog = None
+        self._catalog_etag = None
+        self._catalog_ts = 0.0
+
+    @staticmethod
+    def _catalog_page_count(response, response_data):
+        """Number of catalog pages advertised by the API; 1 when it doesn't paginate."""
+        total_pages = response.headers.get('X-Total-Pages') or response_data.get('total_pages')
+        if total_pages is None and response_data.get('total') and response_data.get('per_page'):
+            total_pages = -(-int(response_data['total']) // int(response_data['per_page'])) # Ceiling division
+        try:
+            return max(1, int(total_pages))
+        except (TypeError, ValueError):
+            return 1
+
+    def _fetch_catalog_page(self, page):
+        """Fetches one catalog page, returning its courses or None on failure."""
+        try:
+            response_data = self._make_request('GET', '/learningbox/list', params={'page': page})
+        except RequestException:
+            return None # Error already logged in _make_request
+        if not response_data or response_data.get('status') != 'ok':
+            logger.error("Unexpected response for Learning Box catalog page %d: %s", page, response_data)
+            return None
+        return response_data.get('modules', [])
+
     def get_catalog(self):
         """Gets the list of all courses from Learning Box."""
-        print("Fetching Learning Box course catalog...")
-        response_data = self._make_request('GET', '/learningbox/list')
+        # Cached for LB_CATALOG_CACHE_TTL seconds, then revalidated by ETag (single-page catalogs only)
+        if self._catalog is not None and time.monotonic() - self._catalog_ts < self.catalog_ttl:
+            logger.info("Using cached Learning Box catalog (%d courses).", len(self._catalog))
+            return self._catalog
+
+        logger.info("Fetching Learning Box course catalog...")
+        headers = None
+        if self._catalog is not None and self._catalog_etag:
+            headers = {"If-None-Match": self._catalog_etag}
+        response = self._send('GET', '/learningbox/list', headers=headers)
+        if response.status_code == 304:
+            logger.info("Learning Box catalog unchanged (%d courses).", len(self._catalog))
+            self._catalog_ts = time.monotonic()
+            return self._catalog
+
+        try:
+            response_data = fast_json.parse_response(response)
+        except RequestException as e:
+            self._log_request_error('GET', response.url, e)
+            raise
         if response_data and response_data.get('status') == 'ok':
             courses = response_data.get('modules', [])
-            print(f"Successfully fetched {len(courses)} courses from Learning Box.")
+            total_pages = self._catalog_page_count(response, response_data)
+            if total_pages > 1:
+                # Page 1 told us how many pages there are: fetch the rest in parallel
+                logger.info("Fetching %d more Learning Box catalog pages...", total_pages - 1)
+                workers = min(self.CATALOG_PAGE_WORKERS, total_pages - 1)
+                with ThreadPoolExecutor(max_workers=workers) as executor:
+                    pages = list(executor.map(self._fetch_catalog_page, range(2, total_pages + 1)))
+                if any(page is None for page in pages):
+                    logger.error("Error fetching Learning Box catalog: some pages failed.")
+                    return [] # Return empty list on failure, a partial catalog isn't cached
+                courses = [course for page in [courses, *pages] for course in page]
+            logger.info("Successfully fetched %d courses from Learning Box.", len(courses))
+            self._catalog = courses
+            # The ETag only covers page 1: a 304 says nothing about pages 2..N
+            self._catalog_etag = response.headers.get('ETag') if total_pages == 1 else None
+            self._catalog_ts = time.monotonic()
             return courses
         else:
-            print("Error fetching Learning Box catalog or unexpected status.")
-            print(f"Received data: {response_data}")
+            logger.error("Error fetching Learning Box catalog or unexpected status.")
+            logger.error("Received data: %s", response_data)
             return [] # Return empty list on failure
 
     def request_scorm_export(self, course_id, webhook_url):
@@ -57,19 +165,30 @@ class LearningBoxClient:
             "webhook_url": webhook_url,
             "webhook_verb": config.LB_REQUEST_WEBHOOK_VERB
         }
-        print(f"Requesting SCORM export for Learning Box Course ID: {course_id}")
+        logger.info("Requesting SCORM export for Learning Box Course ID: %s", course_id)
         try:
             # Assuming the API returns JSON confirmation, adjust if not
             response_data = self._make_request('POST', '/learningbox/request-by-id', json=payload)
-            print(f"SCORM export request successful for Course ID {course_id}. Response: {response_data}")
+            logger.info("SCORM export request successful for Course ID %s. Response: %s", course_id, response_data)
             return response_data # Or True if no specific data is returned on success
         except RequestException as e:
             # Error already logged in _make_request
-            print(f"SCORM export request failed for Course ID {course_id}.")
+            logger.error("SCORM export request failed for Course ID %s.", course_id)
             return None # Indicate failure
 
+    def bulk_request_scorm_exports(self, course_ids, webhook_url, max_workers=8):
+        """Requests SCORM exports for several courses in parallel, returning results in course_ids order (None on failure)."""
+        course_ids = list(course_ids)
+        if not course_ids:
+            return []
+        # More threads than pooled connections would just queue on the pool
+        workers = max(1, min(max_workers, self.POOL_MAXSIZE, len(course_ids)))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(lambda course_id: self.request_scorm_export(course_id, webhook_url), course_ids))
+
 # Example usage:
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
     try:
         config.validate_config()
         client = LearningBoxClient()
@@ -1,42 +1,202 @@
-import json
+import atexit
+import functools
+import logging
 import os
+import sqlite3
+import threading
 import config
+import fast_json
 
-def load_mapping():
-    """Loads the mapping from the JSON file specified in config."""
-    if not os.path.exists(config.MAPPING_FILE_PATH):
+logger = logging.getLogger(__name__)
+
+# The mapping lives in SQLite (WAL mode): updates are single indexed upserts
+# instead of full-file rewrites, and the sync script and the webhook handler
+# can read and write it concurrently.
+_SCHEMA = "CREATE TABLE IF NOT EXISTS mapping (lb_id INTEGER PRIMARY KEY, riseup_step_id INTEGER NOT NULL)"
+# What a sync has already created for each course, so an interrupted one resumes
+# where it stopped instead of recreating (or skipping) the whole structure.
+_PROGRESS_SCHEMA = """CREATE TABLE IF NOT EXISTS progress (
+    lb_id INTEGER PRIMARY KEY,
+    course_id INTEGER,
+    module_id INTEGER,
+    step_id INTEGER,
+    image_uploaded INTEGER NOT NULL DEFAULT 0,
+    banner_uploaded INTEGER NOT NULL DEFAULT 0
+)"""
+PROGRESS_FIELDS = ('course_id', 'module_id', 'step_id', 'image_uploaded', 'banner_uploaded')
+
+_local = threading.local() # sqlite3 connections can't be shared between threads
+_init_lock = threading.Lock()
+_initialized_path = None
+
+def _connect():
+    """Returns this thread's connection to the mapping database, creating it if needed."""
+    path = config.MAPPING_DB_PATH
+    conn = getattr(_local, "conn", None)
+    if conn is not None and _local.path == path:
+        return conn
+    conn = sqlite3.connect(path, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL") # Durable enough with WAL, far fewer fsyncs
+    _initialize(conn, path)
+    _local.conn = conn
+    _local.path = path
+    return conn
+
+def _initialize(conn, path):
+    """Creates the table and, the first time, imports the legacy JSON mapping file."""
+    global _initialized_path
+    with _init_lock:
+        if _initialized_path == path:
+            return
+        with conn:
+            conn.execute(_SCHEMA)
+            conn.execute(_PROGRESS_SCHEMA)
+            empty = conn.execute("SELECT 1 FROM mapping LIMIT 1").fetchone() is None
+            if empty:
+                legacy = _load_legacy_json(config.MAPPING_FILE_PATH)
+                if legacy:
+                    conn.executemany("INSERT OR REPLACE INTO mapping VALUES (?, ?)", legacy.items())
+                    logger.info("Imported %d mappings from %s.", len(legacy), config.MAPPING_FILE_PATH)
+        clear_cache() # Cached lookups belong to the previous database
+        _initialized_path = path
+
+def _load_legacy_json(path):
+    """Reads the mapping from the JSON file used before the SQLite store."""
+    if not os.path.exists(path):
         return {}
     try:
-        with open(config.MAPPING_FILE_PATH, 'r') as f:
-            return json.load(f)
-    except json.JSONDecodeError:
-        print(f"Warning: Mapping file {config.MAPPING_FILE_PATH} is corrupted. Starting with an empty mapping.")
+        with open(path, 'rb') as f:
+            # Keys are LB course IDs, stored as strings in the JSON file
+            return {int(k): v for k, v in fast_json.loads(f.read()).items()}
+    except ValueError: # Invalid JSON or non-numeric course IDs
+        logger.warning("Mapping file %s is corrupted. Not importing it.", path)
         return {}
     except IOError as e:
-        print(f"Warning: Could not read mapping file {config.MAPPING_FILE_PATH}: {e}. Starting with an empty mapping.")
+        logger.warning("Could not read mapping file %s: %s. Not importing it.", path, e)
+        return {}
+
+def load_mapping():
+    """Loads the whole mapping as a dict of LB course ID (int) -> Rise Up step ID."""
+    try:
+        return dict(_connect().execute("SELECT lb_id, riseup_step_id FROM mapping"))
+    except sqlite3.Error as e:
+        logger.warning("Could not read mapping database %s: %s. Starting with an empty mapping.", config.MAPPING_DB_PATH, e)
         return {}
 
 def save_mapping(mapping_data):
-    """Saves the mapping data to the JSON file specified in config."""
+    """Inserts or updates every entry of mapping_data in one transaction."""
     try:
-        with open(config.MAPPING_FILE_PATH, 'w') as f:
-            json.dump(mapping_data, f, indent=4)
-    except IOError as e:
-        print(f"Error: Could not write mapping file {config.MAPPING_FILE_PATH}: {e}")
+        with _connect() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO mapping VALUES (?, ?)",
+                ((int(lb_id), step_id) for lb_id, step_id in mapping_data.items())
+            )
+    except sqlite3.Error as e:
+        logger.error("Could not write mapping database %s: %s", config.MAPPING_DB_PATH, e)
+    finally:
+        clear_cache()
+
+# Webhooks look up the same few courses over and over: keep found step IDs in
+# memory. Misses are not cached, since the sync script adds mappings from
+# another process; a course re-mapped by another process is only seen here
+# after clear_cache() or a restart.
+@functools.lru_cache(maxsize=4096)
+def _cached_step_id(lb_id):
+    row = _connect().execute("SELECT riseup_step_id FROM mapping WHERE lb_id = ?", (lb_id,)).fetchone()
+    if row is None:
+        raise KeyError(lb_id) # lru_cache doesn't store exceptions
+    return row[0]
 
-def add_or_update_mapping(lb_course_id, riseup_step_id):
+def clear_cache():
+    """Drops the in-memory step ID lookups; the next ones read the database."""
+    _cached_step_id.cache_clear()
+
+class MappingStore:
+    """Buffers mapping updates and writes them in one transaction when flushed."""
+    def __init__(self):
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def set(self, lb_course_id, riseup_step_id):
+        with self._lock:
+            self._pending[int(lb_course_id)] = riseup_step_id
+
+    def get(self, lb_course_id):
+        with self._lock:
+            pending = self._pending.get(int(lb_course_id))
+        return pending if pending is not None else get_riseup_step_id(lb_course_id)
+
+    def flush(self):
+        """Writes pending changes to the database, if any."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if pending:
+            save_mapping(pending)
+
+store = MappingStore()
+atexit.register(store.flush)
+
+def add_or_update_mapping(lb_course_id, riseup_step_id, flush=True):
     """Adds or updates a mapping for a specific Learning Box course ID."""
-    mapping = load_mapping()
-    mapping[str(lb_course_id)] = riseup_step_id # Ensure keys are strings
-    save_mapping(mapping)
-    print(f"Mapping updated: LB Course {lb_course_id} -> RiseUp Step {riseup_step_id}")
+    # With flush=False, call store.flush() after the batch (it also runs at exit)
+    store.set(lb_course_id, riseup_step_id)
+    if flush:
+        store.flush()
+    logger.info("Mapping updated: LB Course %s -> RiseUp Step %s", lb_course_id, riseup_step_id)
 
 def get_riseup_step_id(lb_course_id):
     """Retrieves the Rise Up Step ID for a given Learning Box course ID."""
-    mapping = load_mapping()
-    return mapping.get(str(lb_course_id)) # Ensure lookup key is a string
+    try:
+        lb_id = int(lb_course_id)
+    except (TypeError, ValueError): # Not a course ID, so never mapped
+        return None
+    try:
+        return _cached_step_id(lb_id)
+    except KeyError:
+        return None
+    except sqlite3.Error as e:
+        logger.error("Could not read mapping database %s: %s", config.MAPPING_DB_PATH, e)
+        return None
+
+def get_progress(lb_course_id):
+    """Returns the recorded sync progress of a course as a dict of PROGRESS_FIELDS."""
+    progress = dict.fromkeys(PROGRESS_FIELDS)
+    progress.update(image_uploaded=False, banner_uploaded=False)
+    try:
+        row = _connect().execute(
+            f"SELECT {', '.join(PROGRESS_FIELDS)} FROM progress WHERE lb_id = ?", (int(lb_course_id),)
+        ).fetchone()
+    except sqlite3.Error as e:
+        logger.error("Could not read mapping database %s: %s", config.MAPPING_DB_PATH, e)
+        return progress
+    if row:
+        progress.update(zip(PROGRESS_FIELDS, row))
+        progress['image_uploaded'] = bool(progress['image_uploaded'])
+        progress['banner_uploaded'] = bool(progress['banner_uploaded'])
+    return progress
+
+def update_progress(lb_course_id, **fields):
+    """Records completed sync steps for a course, e.g. update_progress(12, module_id=34)."""
+    unknown = set(fields) - set(PROGRESS_FIELDS)
+    if unknown:
+        raise ValueError(f"Unknown progress fields: {', '.join(sorted(unknown))}")
+    if not fields:
+        return
+    columns = ', '.join(fields)
+    updates = ', '.join(f"{name} = excluded.{name}" for name in fields)
+    try:
+        with _connect() as conn:
+            conn.execute(
+                f"INSERT INTO progress (lb_id, {columns}) VALUES (?{', ?' * len(fields)}) "
+                f"ON CONFLICT(lb_id) DO UPDATE SET {updates}",
+                (int(lb_course_id), *fields.values())
+            )
+    except sqlite3.Error as e:
+        logger.error("Could not write mapping database %s: %s", config.MAPPING_DB_PATH, e)
 
 if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
     # Example Usage
     print("Loading initial mapping:")
     print(load_mapping())
@@ -53,4 +213,4 @@ if __name__ == '__main__':
     print("\nRetrieving specific mappings:")
     print(f"RiseUp Step ID for LB 123: {get_riseup_step_id(123)}")
     print(f"RiseUp Step ID for LB '456': {get_riseup_step_id('456')}")
-    print(f"RiseUp Step ID for LB 789: {get_riseup_step_id(789)}") 
\ No newline at end of file
+    print(f"RiseUp Step ID for LB 789: {get_riseup_step_id(789)}")
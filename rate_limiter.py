@@ -0,0 +1,133 @@
+import logging
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+from urllib.parse import urlsplit
+from requests.adapters import HTTPAdapter
+import config
+
+logger = logging.getLogger(__name__)
+
+# Wait applied on a 429 response without a usable Retry-After header
+DEFAULT_THROTTLE_DELAY = 1.0
+
+class RateLimiter:
+    """Thread-safe token bucket allowing `rate` requests every `per` seconds.
+
+    The rate adapts to the server: each throttled response cuts it by 20%,
+    and every `recovery_window` successful responses raise it by 5%, up to
+    the configured rate.
+    """
+    def __init__(self, rate=10, per=1.0, min_rate=0.5, recovery_window=50):
+        self.max_rate = rate / per # Tokens per second
+        self.rate = self.max_rate
+        self.min_rate = min_rate
+        self.recovery_window = recovery_window
+        self.capacity = max(1.0, self.max_rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._clean_responses = 0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Blocks until a request may be sent."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if now >= self._blocked_until:
+                    self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                    self._updated = now
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        return
+                    wait = (1 - self._tokens) / self.rate
+                else:
+                    wait = self._blocked_until - now
+            time.sleep(wait)
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+    def throttled(self, retry_after=None):
+        """Records a 429: pauses all callers for `retry_after` seconds and slows down."""
+        with self._lock:
+            self.rate = max(self.min_rate, self.rate * 0.8)
+            self._clean_responses = 0
+            if retry_after:
+                self._blocked_until = max(self._blocked_until, time.monotonic() + retry_after)
+                # Start refilling from an empty bucket once the pause is over
+                self._tokens = 0.0
+                self._updated = self._blocked_until
+
+    def succeeded(self):
+        """Records a non-throttled response, creeping back towards the configured rate."""
+        with self._lock:
+            self._clean_responses += 1
+            if self._clean_responses >= self.recovery_window:
+                self._clean_responses = 0
+                self.rate = min(self.max_rate, self.rate * 1.05)
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+def get_limiter(host):
+    """Returns the limiter shared by every client talking to `host`."""
+    with _limiters_lock:
+        limiter = _limiters.get(host)
+        if limiter is None:
+            limiter = _limiters[host] = RateLimiter(config.RATE_LIMIT_PER_SECOND)
+        return limiter
+
+def parse_retry_after(value):
+    """Returns the delay in seconds from a Retry-After header (seconds or HTTP date), or None."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+def _is_replayable(request):
+    # Streamed bodies (files, multipart encoders) are consumed by the first attempt
+    return request.body is None or isinstance(request.body, (bytes, str))
+
+class RateLimitedAdapter(HTTPAdapter):
+    """HTTPAdapter that paces requests with the per-host limiter.
+
+    On a 429 it waits for the server's Retry-After, lowers the host's rate,
+    and replays the request when its body allows it.
+    """
+    def __init__(self, *args, max_throttle_retries=3, **kwargs):
+        self.max_throttle_retries = max_throttle_retries
+        super().__init__(*args, **kwargs)
+
+    def send(self, request, **kwargs):
+        limiter = get_limiter(urlsplit(request.url).netloc)
+        attempt = 0
+        while True:
+            limiter.acquire()
+            response = super().send(request, **kwargs)
+            if response.status_code != 429:
+                limiter.succeeded()
+                return response
+            retry_after = parse_retry_after(response.headers.get('Retry-After'))
+            limiter.throttled(retry_after if retry_after is not None else DEFAULT_THROTTLE_DELAY)
+            if attempt >= self.max_throttle_retries or not _is_replayable(request):
+                return response
+            attempt += 1
+            logger.warning("Rate limited by %s (429), retrying %s %s (attempt %d).",
+                           urlsplit(request.url).netloc, request.method, request.url, attempt)
+            response.close()
@@ -1,49 +1,151 @@
+import logging
 import requests
 import base64
+import hashlib
+import mmap
+import os
+import threading
 import time
 import config
+import fast_json
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from types import MappingProxyType
+from rate_limiter import RateLimitedAdapter
 from requests.exceptions import RequestException
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger(__name__)
+
+try:
+    # Streams multipart bodies instead of building them in memory
+    from requests_toolbelt import MultipartEncoder
+except ImportError:
+    MultipartEncoder = None
+
+@contextmanager
+def _open_upload(source):
+    """Yields a binary file-like object for a path, or the given file object/bytes."""
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, 'rb') as fh:
+            yield fh
+    else:
+        yield source
+
+class _MappedReader:
+    """Reads a memory map front to back; len() is the number of bytes not read yet."""
+    # A bare mmap's len() never shrinks, so MultipartEncoder would keep reading it forever
+    def __init__(self, mm):
+        self._mm = mm
+
+    def read(self, size=-1):
+        return self._mm.read(size)
+
+    def __len__(self):
+        return len(self._mm) - self._mm.tell()
+
+def _outcome(call, *args):
+    """Returns call(*args), or the exception it raised."""
+    try:
+        return call(*args)
+    except Exception as e:
+        return e
+
+def make_idempotency_key(*parts):
+    """Derives a stable Idempotency-Key from the values identifying one create call."""
+    # Same course/sub-step, same key: the server can return the original resource on a re-run
+    return hashlib.sha256("|".join(map(str, parts)).encode()).hexdigest()[:32]
+
+def _idempotency_headers(key):
+    return {'Idempotency-Key': key} if key else {}
 
 class RiseUpClient:
+    # Fixed fields of the create payloads; per-call values are unpacked over them
+    _COURSE_TPL = MappingProxyType({
+        "type": "internal", # As per requirement
+        "state": "validated", # Or "draft"?
+        "visible": True, # Default visibility
+    })
+    _MODULE_TPL = MappingProxyType({"type": "online"}) # For SCORM
+    _STEP_TPL = MappingProxyType({"type": "scorm"})
+
     def __init__(self):
         self.base_url = config.RISEUP_API_ENDPOINT.rstrip('/')
         self.public_key = config.RISEUP_PUBLIC_KEY
         self.private_key = config.RISEUP_PRIVATE_KEY
         self.creator_user_id = config.RISEUP_CREATOR_USER_ID
         self.access_token = None
-        self.token_expiry = 0
+        # Expiry on the monotonic clock, immune to wall-clock jumps
+        self._token_expiry_monotonic = 0.0
+        # Single-flight token refresh when the client is shared between threads
+        self._token_lock = threading.Lock()
+        # Basic auth header for token requests, computed once since the keys never change
+        credentials = f"{self.public_key}:{self.private_key}".encode()
+        self._basic_auth_header = "Basic " + base64.b64encode(credentials).decode()
+        # Static header templates, copied per request with the current bearer token
+        self._base_json_headers = {"Accept": "application/json", "Content-Type": "application/json"}
+        self._base_get_headers = {"Accept": "application/json"}
+        # One Session per client so token refreshes, creations and uploads share
+        # pooled keep-alive connections to the RiseUp host.
+        # Retries only apply to idempotent methods (urllib3 default), so POSTs
+        # creating courses/modules/steps are never replayed.
+        self.session = requests.Session()
+        # The adapter also paces requests per host and honours 429 Retry-After.
+        adapter = RateLimitedAdapter(
+            pool_maxsize=config.HTTP_POOL_MAXSIZE,
+            pool_block=True, # Wait for a pooled connection rather than open a throwaway one
+            max_retries=Retry(total=3, backoff_factor=0.2, status_forcelist=[502, 503, 504], raise_on_status=False)
+        )
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def close(self):
+        """Closes the underlying HTTP session and its pooled connections."""
+        self.session.close()
+
+    def __enter__(self):
+        return self
 
-    def _get_auth_header(self):
-        """Gets the Basic Auth header for token requests."""
-        credentials = f"{self.public_key}:{self.private_key}"
-        encoded_credentials = base64.b64encode(credentials.encode()).decode()
-        return f"Basic {encoded_credentials}"
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _token_valid(self):
+        return self.access_token is not None and time.monotonic() < self._token_expiry_monotonic
 
     def _ensure_token(self):
         """Ensures a valid access token is available, refreshing if necessary."""
-        if not self.access_token or time.time() >= self.token_expiry:
-            print("RiseUp token expired or not found, requesting new token...")
+        if self._token_valid():
+            return
+        with self._token_lock:
+            # Another thread may have refreshed the token while we waited
+            if self._token_valid():
+                return
+            logger.info("RiseUp token expired or not found, requesting new token...")
             token_url = f"{self.base_url}/oauth/token"
             headers = {
-                "Authorization": self._get_auth_header(),
+                "Authorization": self._basic_auth_header,
                 "Content-Type": "application/x-www-form-urlencoded"
             }
             data = {"grant_type": "client_credentials"}
             try:
-                response = requests.post(token_url, headers=headers, data=data)
+                response = self.session.post(token_url, headers=headers, data=data)
                 response.raise_for_status() # Raise HTTPError for bad responses (4xx or 5xx)
-                token_data = response.json()
+                token_data = fast_json.parse_response(response)
+                # Replace the token before the expiry: an unlocked reader may then see the
+                # new token with the old (past) expiry and wait on the lock, but never the
+                # new expiry with the old, expired token.
                 self.access_token = token_data['access_token']
                 # Set expiry a bit earlier to avoid edge cases
-                self.token_expiry = time.time() + token_data['expires_in'] - 60
-                print("RiseUp token obtained successfully.")
+                self._token_expiry_monotonic = time.monotonic() + token_data['expires_in'] - 60
+                logger.info("RiseUp token obtained successfully.")
             except RequestException as e:
-                print(f"Error obtaining RiseUp token: {e}")
+                logger.error("Error obtaining RiseUp token: %s", e)
                 if e.response is not None:
-                    print(f"Response status: {e.response.status_code}")
-                    print(f"Response body: {e.response.text}")
+                    logger.error("Response status: %s", e.response.status_code)
+                    if logger.isEnabledFor(logging.DEBUG):
+                        logger.debug("Response body: %s", e.response.text)
                 self.access_token = None
-                self.token_expiry = 0
+                self._token_expiry_monotonic = 0.0
                 raise # Re-raise the exception after logging
 
     def _make_request(self, method, endpoint, **kwargs):
@@ -53,14 +155,11 @@ class RiseUpClient:
             raise ConnectionError("Failed to obtain RiseUp access token.")
 
         url = f"{self.base_url}{endpoint}"
-        headers = kwargs.pop('headers', {})
-        headers['Authorization'] = f"Bearer {self.access_token}"
-        headers.setdefault('Accept', 'application/json')
-        if method in ('POST', 'PUT') and 'json' in kwargs and 'Content-Type' not in headers:
-             headers['Content-Type'] = 'application/json'
+        template = self._base_json_headers if method in ('POST', 'PUT') and 'json' in kwargs else self._base_get_headers
+        headers = {**template, **kwargs.pop('headers', {}), 'Authorization': f"Bearer {self.access_token}"}
 
         try:
-            response = requests.request(method, url, headers=headers, **kwargs)
+            response = self.session.request(method, url, headers=headers, **kwargs)
             response.raise_for_status()
 
             # Handle potential 204 No Content responses
@@ -68,29 +167,29 @@ class RiseUpClient:
                 return None
             # Handle 206 Partial Content (though we might need specific logic later if needed)
             if response.status_code == 206:
-                print(f"Warning: Received 206 Partial Content for {url}. Full handling may be needed.")
+                logger.warning("Received 206 Partial Content for %s. Full handling may be needed.", url)
                 # Potentially parse Link/Content-Range headers here if pagination is required
-            return response.json()
+            return fast_json.parse_response(response)
         except RequestException as e:
-            print(f"Error during RiseUp API call ({method} {url}): {e}")
+            logger.error("Error during RiseUp API call (%s %s): %s", method, url, e)
             if e.response is not None:
-                print(f"Response status: {e.response.status_code}")
-                print(f"Response body: {e.response.text}")
+                logger.error("Response status: %s", e.response.status_code)
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("Response body: %s", e.response.text)
             raise
 
-    def create_course(self, title, description="", objective="", reference="", eduduration=0, language="en-US", keywords=None, **other_fields):
-        """Creates a new course in Rise Up."""
+    def create_course(self, title, description="", objective="", reference="", eduduration=0, language="en-US", keywords=None,
+                      idempotency_key=None, **other_fields):
+        """Creates a new course in Rise Up, sent with idempotency_key if given."""
         payload = {
+            **self._COURSE_TPL,
             "title": title,
-            "type": "internal", # As per requirement
             "iduser": self.creator_user_id,
             "language": language,
             "description": description,
             "objective": objective,
             "reference": reference,
             "eduduration": eduduration,
-            "state": "validated", # Or "draft"?
-            "visible": True, # Default visibility
             # Only include keywords if provided and it's a non-empty list
             # RiseUp API expects an array, even if empty, if the key is present
             "keywords": keywords if keywords is not None else [],
@@ -100,122 +199,141 @@ class RiseUpClient:
         # if not payload["keywords"]:
         #     del payload["keywords"]
 
-        print(f"Creating RiseUp Course: {title}")
-        return self._make_request('POST', '/courses', json=payload)
+        logger.info("Creating RiseUp Course: %s", title)
+        return self._make_request('POST', '/courses', json=payload, headers=_idempotency_headers(idempotency_key))
 
-    def create_module(self, course_id, title, description="", reference="", position=1, eduduration=0):
-        """Creates a new module within a course."""
+    def create_module(self, course_id, title, description="", reference="", position=1, eduduration=0, idempotency_key=None):
+        """Creates a new module within a course, sent with idempotency_key if given."""
         payload = {
+            **self._MODULE_TPL,
             "idtraining": course_id,
             "title": title,
-            "type": "online", # For SCORM
             "description": description,
             "reference": reference,
             "position": position,
             "eduduration": eduduration # Add duration to payload
         }
-        print(f"Creating RiseUp Module '{title}' in Course ID {course_id} with duration {eduduration}")
-        return self._make_request('POST', '/modules', json=payload)
+        logger.info("Creating RiseUp Module '%s' in Course ID %s with duration %s", title, course_id, eduduration)
+        return self._make_request('POST', '/modules', json=payload, headers=_idempotency_headers(idempotency_key))
 
-    def create_scorm_step(self, module_id, title, description="", reference="", position=1):
-        """Creates a new SCORM step within a module."""
+    def create_scorm_step(self, module_id, title, description="", reference="", position=1, idempotency_key=None):
+        """Creates a new SCORM step within a module, sent with idempotency_key if given."""
         payload = {
+            **self._STEP_TPL,
             "idmodule": module_id,
             "title": title,
-            "type": "scorm",
             "description": description,
             "reference": reference,
             "position": position
         }
-        print(f"Creating RiseUp SCORM Step '{title}' in Module ID {module_id}")
-        return self._make_request('POST', '/steps', json=payload)
+        logger.info("Creating RiseUp SCORM Step '%s' in Module ID %s", title, module_id)
+        return self._make_request('POST', '/steps', json=payload, headers=_idempotency_headers(idempotency_key))
 
-    def upload_scorm_content(self, step_id, file_content, filename="scorm_package.zip"):
-        """Uploads SCORM content to a specific step."""
-        endpoint = f"/steps/content/{step_id}"
-        files = {
-            'file': (filename, file_content, 'application/zip')
-        }
-        # Note: requests handles multipart/form-data encoding automatically when using 'files'
-        # We don't set Content-Type explicitly here for multipart
-        print(f"Uploading SCORM content to Step ID {step_id}")
-        # Need to pass headers without Content-Type for multipart
+    def create_module_with_scorm_step(self, course_id, module_title, step_title, reference="", eduduration=0,
+                                      module_key=None, step_key=None):
+        """Creates a module and its SCORM step (reference + "_S1"), returning (module_data, step_data)."""
+        # No batch endpoint and the step needs the module ID: two sequential POSTs
+        module = self.create_module(course_id, module_title, reference=reference, eduduration=eduduration,
+                                    idempotency_key=module_key)
+        if not module or 'id' not in module:
+            return module, None
+        try:
+            step = self.create_scorm_step(module['id'], step_title, reference=f"{reference}_S1", idempotency_key=step_key)
+        except (RequestException, ConnectionError): # Already logged; the module exists, so still return it
+            step = None
+        return module, step
+
+    def _post_file(self, endpoint, source, filename, content_type=None):
+        """POSTs a single file (a path, file object or bytes) as multipart/form-data and returns the raw response."""
+        # Paths and file objects are streamed rather than read into memory up front
         self._ensure_token()
-        headers = {
-            'Authorization': f"Bearer {self.access_token}",
-            'Accept': 'application/json'
-        }
+        # No Content-Type here: it carries the multipart boundary
+        headers = {**self._base_get_headers, 'Authorization': f"Bearer {self.access_token}"}
+        url = f"{self.base_url}{endpoint}"
+        with _open_upload(source) as fh:
+            file_field = (filename, fh, content_type) if content_type else (filename, fh)
+            if MultipartEncoder is not None:
+                encoder = MultipartEncoder(fields={'file': file_field})
+                headers['Content-Type'] = encoder.content_type
+                return self.session.post(url, headers=headers, data=encoder)
+            return self.session.post(url, headers=headers, files={'file': file_field})
+
+    def upload_scorm_content(self, step_id, file_path_or_obj, filename="scorm_package.zip"):
+        """Uploads SCORM content (a path, file object or bytes) to a specific step."""
+        endpoint = f"/steps/content/{step_id}"
+        logger.info("Uploading SCORM content to Step ID %s", step_id)
         try:
-            response = requests.post(f"{self.base_url}{endpoint}", headers=headers, files=files)
+            response = self._post_file(endpoint, file_path_or_obj, filename, 'application/zip')
             response.raise_for_status()
-            print(f"SCORM upload successful for Step ID {step_id}")
+            logger.info("SCORM upload successful for Step ID %s", step_id)
             if response.status_code == 204:
                 return None
-            return response.json() # Return response data if any (e.g., updated step info)
+            return fast_json.parse_response(response) # Return response data if any (e.g., updated step info)
         except RequestException as e:
-             print(f"Error uploading SCORM to RiseUp Step {step_id}: {e}")
+             logger.error("Error uploading SCORM to RiseUp Step %s: %s", step_id, e)
              if e.response is not None:
-                 print(f"Response status: {e.response.status_code}")
-                 print(f"Response body: {e.response.text}")
+                 logger.error("Response status: %s", e.response.status_code)
+                 if logger.isEnabledFor(logging.DEBUG):
+                     logger.debug("Response body: %s", e.response.text)
              raise
 
-    # Optional: Add methods for image/banner upload if needed later
-    def upload_course_image(self, course_id, image_content, filename):
-         """Uploads an image for a course."""
+    def upload_scorm_content_mmap(self, step_id, path, filename="scorm_package.zip"):
+        """Uploads a SCORM zip from disk through a read-only memory map."""
+        with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return self.upload_scorm_content(step_id, _MappedReader(mm), filename)
+
+    def upload_course_image(self, course_id, image_file, filename):
+         """Uploads an image (a path, file object or bytes) for a course."""
          endpoint = f"/courses/image/{course_id}"
-         files = {
-             'file': (filename, image_content)
-         }
-         print(f"Uploading image '{filename}' to Course ID {course_id}")
-         # Use _make_request but with files, Content-Type will be set by requests
-         # Need to adjust _make_request or handle headers specifically for multipart
-         self._ensure_token()
-         headers = {
-             'Authorization': f"Bearer {self.access_token}",
-             'Accept': 'application/json'
-         }
+         logger.info("Uploading image '%s' to Course ID %s", filename, course_id)
          try:
-             response = requests.post(f"{self.base_url}{endpoint}", headers=headers, files=files)
+             response = self._post_file(endpoint, image_file, filename)
              response.raise_for_status()
-             print(f"Image upload successful for Course ID {course_id}")
+             logger.info("Image upload successful for Course ID %s", course_id)
              if response.status_code == 204:
                  return None
-             return response.json()
+             return fast_json.parse_response(response)
          except RequestException as e:
-             print(f"Error uploading image to RiseUp Course {course_id}: {e}")
+             logger.error("Error uploading image to RiseUp Course %s: %s", course_id, e)
              if e.response is not None:
-                 print(f"Response status: {e.response.status_code}")
-                 print(f"Response body: {e.response.text}")
+                 logger.error("Response status: %s", e.response.status_code)
+                 if logger.isEnabledFor(logging.DEBUG):
+                     logger.debug("Response body: %s", e.response.text)
              raise
 
-    def upload_course_banner(self, course_id, banner_content, filename):
-        """Uploads a banner for a course."""
+    def upload_course_banner(self, course_id, banner_file, filename):
+        """Uploads a banner (a path, file object or bytes) for a course."""
         endpoint = f"/courses/banner/{course_id}" # Corrected endpoint
-        files = {
-            'file': (filename, banner_content)
-        }
-        print(f"Uploading banner '{filename}' to Course ID {course_id}")
-        self._ensure_token()
-        headers = {
-            'Authorization': f"Bearer {self.access_token}",
-            'Accept': 'application/json'
-        }
+        logger.info("Uploading banner '%s' to Course ID %s", filename, course_id)
         try:
-            response = requests.post(f"{self.base_url}{endpoint}", headers=headers, files=files)
+            response = self._post_file(endpoint, banner_file, filename)
             response.raise_for_status()
-            print(f"Banner upload successful for Course ID {course_id}")
+            logger.info("Banner upload successful for Course ID %s", course_id)
             if response.status_code == 204:
                 return None
-            return response.json()
+            return fast_json.parse_response(response)
         except RequestException as e:
-            print(f"Error uploading banner to RiseUp Course {course_id}: {e}")
+            logger.error("Error uploading banner to RiseUp Course %s: %s", course_id, e)
             if e.response is not None:
-                print(f"Response status: {e.response.status_code}")
-                print(f"Response body: {e.response.text}")
+                logger.error("Response status: %s", e.response.status_code)
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("Response body: %s", e.response.text)
             raise
 
+    def upload_course_media(self, course_id, image=None, banner=None):
+        """Uploads a course image and/or banner (file, filename) at once, returning (image, banner) outcomes."""
+        # An outcome is the response data, None (file not given) or the exception raised
+        if image is None or banner is None: # Nothing to overlap
+            return (_outcome(self.upload_course_image, course_id, *image) if image is not None else None,
+                    _outcome(self.upload_course_banner, course_id, *banner) if banner is not None else None)
+        with ThreadPoolExecutor(max_workers=2, thread_name_prefix="course-media") as executor:
+            futures = [executor.submit(_outcome, self.upload_course_image, course_id, *image),
+                       executor.submit(_outcome, self.upload_course_banner, course_id, *banner)]
+        return tuple(future.result() for future in futures)
+
 # Example usage:
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
     try:
         config.validate_config()
         client = RiseUpClient()
@@ -241,9 +359,8 @@ if __name__ == "__main__":
         #         # Example Upload (replace with actual file reading and step_id)
         #         # step_id_to_upload = step_data['id']
         #         # try:
-        #         #     with open("path/to/your/scorm.zip", "rb") as f:
-        #         #         scorm_content = f.read()
-        #         #     upload_response = client.upload_scorm_content(step_id_to_upload, scorm_content, "scorm.zip")
+        #         #     # Paths are streamed from disk, no need to read the zip first
+        #         #     upload_response = client.upload_scorm_content(step_id_to_upload, "path/to/your/scorm.zip", "scorm.zip")
         #         #     print("Upload response:", upload_response)
         #         # except FileNotFoundError:
         #         #     print("SCORM file not found for upload example.")
@@ -1,52 +1,199 @@
+import asyncio
+import io
+import logging
+import mimetypes
+import queue
 import config
 from learningbox_client import LearningBoxClient
-from riseup_client import RiseUpClient
+from riseup_client import RiseUpClient, make_idempotency_key
 import mapping_store
-import time
 import requests # Added for downloading
 import os       # Added for path manipulation
+import tempfile
 from urllib.parse import urlparse # Added for filename extraction
+from concurrent.futures import ThreadPoolExecutor
+from logging.handlers import QueueHandler, QueueListener
+from requests.adapters import HTTPAdapter
 from requests.exceptions import RequestException
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger(__name__)
+
+# Shared by all media downloads: images and banners mostly come from the same
+# Learning Box host, so pooled keep-alive connections save a handshake per file.
+# requests already sends "Accept-Encoding: gzip, deflate" by default.
+_SESSION = requests.Session()
+_adapter = HTTPAdapter(
+    pool_maxsize=config.HTTP_POOL_MAXSIZE,
+    pool_block=True,
+    max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=[429, 502, 503, 504], raise_on_status=False)
+)
+_SESSION.mount('https://', _adapter)
+_SESSION.mount('http://', _adapter)
+
+# Accepted filename suffixes per media type; the first one is appended when missing
+_EXT_MAP = {
+    'image/jpeg': ('.jpg', '.jpeg'),
+    'image/png': ('.png',),
+    'image/gif': ('.gif',),
+    'image/webp': ('.webp',),
+    'image/svg+xml': ('.svg',),
+}
+
+def _with_extension(filename, content_type):
+    """Appends the extension matching content_type unless filename already has one."""
+    ct = content_type.split(';', 1)[0].strip().lower()
+    suffixes = _EXT_MAP.get(ct)
+    if suffixes is None:
+        ext = mimetypes.guess_extension(ct)
+        if not ext:
+            return filename
+        suffixes = (ext,)
+    if filename.lower().endswith(suffixes):
+        return filename
+    return filename + suffixes[0]
 
 def download_content(url):
-    """Downloads content from a URL and returns bytes and filename."""
+    """Downloads content from a URL and returns a file object (closed by the caller) and filename."""
+    # HTML error pages and bodies over config.MAX_MEDIA_BYTES give (None, None)
     if not url:
         return None, None
     try:
-        print(f"    Downloading content from: {url}", flush=True)
-        response = requests.get(url, stream=True, timeout=30) # Added timeout
-        response.raise_for_status()
-
-        # Extract filename from URL path
-        path = urlparse(url).path
-        filename = os.path.basename(path) if path else "downloaded_file"
-        # Improve filename if it's empty or just '/' e.g. from base URLs
-        if not filename or filename == "/":
-             filename = url.split('/')[-1] or "downloaded_file"
-             # Add extension based on content type if possible?
-             content_type = response.headers.get('content-type')
-             if content_type:
-                 # Basic extension mapping
-                 if 'image/jpeg' in content_type and not filename.lower().endswith(('.jpg', '.jpeg')):
-                     filename += ".jpg"
-                 elif 'image/png' in content_type and not filename.lower().endswith('.png'):
-                      filename += ".png"
-                 elif 'image/gif' in content_type and not filename.lower().endswith('.gif'):
-                      filename += ".gif"
-                 # Add more types if needed
-
-        content = response.content
-        print(f"    Downloaded {len(content)} bytes as '{filename}'", flush=True)
+        logger.info("    Downloading content from: %s", url)
+        with _SESSION.get(url, stream=True, timeout=30) as response: # Closed without reading a rejected body
+            response.raise_for_status()
+
+            content_type = response.headers.get('content-type', '')
+            if content_type.split(';', 1)[0].strip().lower() == 'text/html':
+                logger.warning("Skipping %s: got an HTML page instead of media.", url)
+                return None, None
+            declared_size = response.headers.get('content-length')
+            if declared_size and declared_size.isdigit() and int(declared_size) > config.MAX_MEDIA_BYTES:
+                logger.warning("Skipping %s: %s bytes exceeds the %d bytes limit.",
+                               url, declared_size, config.MAX_MEDIA_BYTES)
+                return None, None
+
+            # Extract filename from URL path
+            path = urlparse(url).path
+            filename = os.path.basename(path) if path else "downloaded_file"
+            # Improve filename if it's empty or just '/' e.g. from base URLs
+            if not filename or filename == "/":
+                 filename = url.split('/')[-1] or "downloaded_file"
+                 # Add extension based on content type if possible
+                 if content_type:
+                     filename = _with_extension(filename, content_type)
+
+            # Not a SpooledTemporaryFile: MultipartEncoder calls fileno() on it, forcing a rollover
+            content = io.BytesIO()
+            try:
+                size = 0
+                # iter_content undoes gzip/deflate; counting catches bodies without (or lying about) Content-Length
+                for chunk in response.iter_content(chunk_size=64 * 1024):
+                    size += len(chunk)
+                    if size > config.MAX_MEDIA_BYTES:
+                        logger.warning("Skipping %s: body exceeds the %d bytes limit.", url, config.MAX_MEDIA_BYTES)
+                        content.close()
+                        return None, None
+                    if size > config.SPOOL_MAX_MEMORY and isinstance(content, io.BytesIO):
+                        spilled = tempfile.TemporaryFile()
+                        spilled.write(content.getvalue())
+                        content.close()
+                        content = spilled
+                    content.write(chunk)
+                content.seek(0)
+            except BaseException:
+                content.close()
+                raise
+        logger.info("    Downloaded %d bytes as '%s'", size, filename)
         return content, filename
     except RequestException as e:
-        print(f"    Warning: Failed to download content from {url}: {e}", flush=True)
+        logger.warning("Failed to download content from %s: %s", url, e)
         return None, None
     except Exception as e:
-        print(f"    Warning: Unexpected error downloading {url}: {e}", flush=True)
+        logger.warning("Unexpected error downloading %s: %s", url, e)
         return None, None
 
-def sync_course_structure(lb_course, riseup_client):
+async def transfer_course_media(riseup_client, riseup_course_id, lb_id, image_url, banner_url):
+    """Downloads the image and banner from Learning Box, then uploads both at once."""
+    # A None URL skips that file (e.g. uploaded by an earlier run). Failures are only
+    # logged: media is optional and must not block the sync.
+    (image, image_name), (banner, banner_name) = await asyncio.gather(
+        asyncio.to_thread(download_content, image_url),
+        asyncio.to_thread(download_content, banner_url)
+    )
+    try:
+        if image is None and banner is None:
+            return
+        logger.info("  Attempting to upload media: %s", ', '.join(n for n in (image_name, banner_name) if n))
+        outcomes = await asyncio.to_thread(
+            riseup_client.upload_course_media,
+            riseup_course_id,
+            image=(image, image_name) if image is not None else None,
+            banner=(banner, banner_name) if banner is not None else None
+        )
+        # Each file is recorded on its own, so a failed banner doesn't cause the image to be re-sent
+        uploaded = {}
+        for label, content, outcome in (('image', image, outcomes[0]), ('banner', banner, outcomes[1])):
+            if content is None:
+                continue
+            if isinstance(outcome, Exception):
+                logger.warning("Failed to upload %s for Course ID %s: %s", label, riseup_course_id, outcome)
+            else:
+                uploaded[f"{label}_uploaded"] = True
+        await asyncio.to_thread(mapping_store.update_progress, lb_id, **uploaded)
+    finally:
+        for content in (image, banner):
+            if content is not None:
+                content.close()
+
+async def create_module_then_step(riseup_client, riseup_course_id, lb_id, lb_reference, lb_duration, progress):
+    """Creates the Rise Up Module and its SCORM Step, returning the step ID or None."""
+    if progress['step_id']:
+        logger.info("  Reusing RiseUp Step ID: %s", progress['step_id'])
+        return progress['step_id']
+    module_reference = f"{lb_reference}_M1" # Step gets "{reference}_S1"
+
+    step_key = make_idempotency_key(lb_id, lb_reference, "step")
+    riseup_module_id = progress['module_id']
+    if riseup_module_id:
+        logger.info("  Reusing RiseUp Module ID: %s", riseup_module_id)
+        riseup_step = await asyncio.to_thread(
+            riseup_client.create_scorm_step,
+            riseup_module_id,
+            "Contenu",
+            reference=f"{module_reference}_S1",
+            idempotency_key=step_key
+        )
+    else:
+        riseup_module, riseup_step = await asyncio.to_thread(
+            riseup_client.create_module_with_scorm_step,
+            course_id=riseup_course_id,
+            module_title="Module 1",
+            step_title="Contenu",
+            reference=module_reference,
+            eduduration=lb_duration, # Pass the duration here
+            module_key=make_idempotency_key(lb_id, lb_reference, "module"),
+            step_key=step_key
+        )
+        if not riseup_module or 'id' not in riseup_module:
+            logger.error("Failed to create RiseUp Module for LB ID %s. Skipping.", lb_id)
+            return None
+        riseup_module_id = riseup_module['id']
+        # Recorded even when the step failed, so the next run reuses this module
+        await asyncio.to_thread(mapping_store.update_progress, lb_id, module_id=riseup_module_id)
+        logger.info("  Created RiseUp Module ID: %s", riseup_module_id)
+
+    if not riseup_step or 'id' not in riseup_step:
+        logger.error("Failed to create RiseUp Step for LB ID %s. Skipping.", lb_id)
+        return None
+    riseup_step_id = riseup_step['id']
+    await asyncio.to_thread(mapping_store.update_progress, lb_id, step_id=riseup_step_id)
+    logger.info("  Created RiseUp Step ID: %s", riseup_step_id)
+    return riseup_step_id
+
+async def sync_course_structure(lb_course, riseup_client):
     """Creates the Course, Module, and SCORM Step structure in Rise Up."""
+    # Sub-steps recorded in the course's sync progress by an interrupted run are skipped
     lb_id = lb_course.get('id')
     lb_title = lb_course.get('name', f"LearningBox Course {lb_id}")
     lb_desc = lb_course.get('description', '')
@@ -58,159 +205,170 @@ def sync_course_structure(lb_course, riseup_client):
     lb_banner_url = lb_course.get('banner')
     # Extract tag names for keywords
     lb_tags = lb_course.get('tags', [])
-    lb_keywords = [tag.get('name') for tag in lb_tags if tag.get('name')]
+    lb_keywords = [name for tag in lb_tags if (name := tag.get('name'))]
 
-    print(f"\nProcessing LearningBox Course: {lb_title} (ID: {lb_id})", flush=True)
+    logger.info("Processing LearningBox Course: %s (ID: %s)", lb_title, lb_id)
     if lb_keywords:
-        print(f"  Found tags to use as keywords: {lb_keywords}", flush=True)
+        logger.info("  Found tags to use as keywords: %s", lb_keywords)
 
+    progress = await asyncio.to_thread(mapping_store.get_progress, lb_id)
     try:
-        # 1. Create Rise Up Course
-        riseup_course = riseup_client.create_course(
-            title=lb_title,
-            description=lb_desc,
-            objective=lb_short_desc,
-            reference=lb_reference,
-            eduduration=lb_duration,
-            language="fr-FR",
-            keywords=lb_keywords # Pass keywords here
-        )
-        if not riseup_course or 'id' not in riseup_course:
-            print(f"Failed to create RiseUp Course for LB ID {lb_id}. Skipping.")
-            return None
-        riseup_course_id = riseup_course['id']
-        print(f"  Created RiseUp Course ID: {riseup_course_id}")
+        # 1. Create Rise Up Course (everything else needs its ID)
+        riseup_course_id = progress['course_id']
+        if riseup_course_id:
+            logger.info("  Reusing RiseUp Course ID: %s", riseup_course_id)
+        else:
+            riseup_course = await asyncio.to_thread(
+                riseup_client.create_course,
+                title=lb_title,
+                description=lb_desc,
+                objective=lb_short_desc,
+                reference=lb_reference,
+                eduduration=lb_duration,
+                language="fr-FR",
+                keywords=lb_keywords, # Pass keywords here
+                idempotency_key=make_idempotency_key(lb_id, lb_reference, "course")
+            )
+            if not riseup_course or 'id' not in riseup_course:
+                logger.error("Failed to create RiseUp Course for LB ID %s. Skipping.", lb_id)
+                return None
+            riseup_course_id = riseup_course['id']
+            await asyncio.to_thread(mapping_store.update_progress, lb_id, course_id=riseup_course_id)
+            logger.info("  Created RiseUp Course ID: %s", riseup_course_id)
 
-        # --- Upload Image and Banner --- #
-        image_content, image_filename = download_content(lb_image_url)
-        if image_content and image_filename:
-            try:
-                print(f"  Attempting to upload image: {image_filename}")
-                riseup_client.upload_course_image(riseup_course_id, image_content, image_filename)
-            except (RequestException, ConnectionError) as e:
-                print(f"  Warning: Failed to upload image for Course ID {riseup_course_id}: {e}")
-            except Exception as e:
-                 print(f"  Warning: Unexpected error uploading image for Course ID {riseup_course_id}: {e}")
-
-        banner_content, banner_filename = download_content(lb_banner_url)
-        if banner_content and banner_filename:
-            try:
-                print(f"  Attempting to upload banner: {banner_filename}")
-                riseup_client.upload_course_banner(riseup_course_id, banner_content, banner_filename)
-            except (RequestException, ConnectionError) as e:
-                print(f"  Warning: Failed to upload banner for Course ID {riseup_course_id}: {e}")
-            except Exception as e:
-                 print(f"  Warning: Unexpected error uploading banner for Course ID {riseup_course_id}: {e}")
-        # --- End Upload --- #
-
-        # 2. Create Rise Up Module
-        module_title = f"Module 1"
-        riseup_module = riseup_client.create_module(
-            course_id=riseup_course_id,
-            title=module_title,
-            reference=f"{lb_reference}_M1",
-            eduduration=lb_duration # Pass the duration here
+        # The media transfer doesn't depend on the module/step, run both branches concurrently
+        # return_exceptions: a failing branch must not leave the other running unawaited
+        # (outside the semaphore, its files closed under a still-running upload)
+        media_result, riseup_step_id = await asyncio.gather(
+            transfer_course_media(
+                riseup_client, riseup_course_id, lb_id,
+                None if progress['image_uploaded'] else lb_image_url,
+                None if progress['banner_uploaded'] else lb_banner_url
+            ),
+            create_module_then_step(riseup_client, riseup_course_id, lb_id, lb_reference, lb_duration, progress),
+            return_exceptions=True
         )
-        if not riseup_module or 'id' not in riseup_module:
-            print(f"Failed to create RiseUp Module for LB ID {lb_id}. Skipping.")
-            return None
-        riseup_module_id = riseup_module['id']
-        print(f"  Created RiseUp Module ID: {riseup_module_id}")
-
-        # 3. Create Rise Up SCORM Step
-        step_title = f"Contenu"
-        riseup_step = riseup_client.create_scorm_step(
-            module_id=riseup_module_id,
-            title=step_title,
-            reference=f"{lb_reference}_M1_S1"
-        )
-        if not riseup_step or 'id' not in riseup_step:
-            print(f"Failed to create RiseUp Step for LB ID {lb_id}. Skipping.")
-            return None
-        riseup_step_id = riseup_step['id']
-        print(f"  Created RiseUp Step ID: {riseup_step_id}")
-
+        if isinstance(media_result, Exception):
+            logger.warning("Unexpected error transferring media for LB ID %s: %s", lb_id, media_result)
+        if isinstance(riseup_step_id, BaseException):
+            raise riseup_step_id
         return riseup_step_id # Return the crucial step ID for mapping
 
     except (RequestException, ConnectionError) as e:
-        print(f"API Error processing LB Course ID {lb_id}: {e}. Skipping.", flush=True)
+        logger.error("API Error processing LB Course ID %s: %s. Skipping.", lb_id, e)
         return None
     except Exception as e:
-        print(f"Unexpected error processing LB Course ID {lb_id}: {e}. Skipping.", flush=True)
+        logger.error("Unexpected error processing LB Course ID %s: %s. Skipping.", lb_id, e)
         return None
 
-def main():
-    print("Starting LearningBox to Rise Up Sync Process...")
+async def sync_course(lb_course, riseup_client, sem):
+    """Creates the Rise Up structure for one course and stores the mapping, returning (lb_id, riseup_step_id)."""
+    lb_id = lb_course.get('id')
+    async with sem:
+        # Create RiseUp Structure
+        riseup_step_id = await sync_course_structure(lb_course, riseup_client)
+
+    if riseup_step_id:
+        # Store the mapping (on disk before the export, the webhook reads it). Mapping
+        # store calls run off the event loop: SQLite may wait on the webhook's write lock.
+        await asyncio.to_thread(mapping_store.add_or_update_mapping, lb_id, riseup_step_id)
+    else:
+        logger.error("Failed to create RiseUp structure for LB ID %s. See previous errors.", lb_id)
+    return lb_id, riseup_step_id
+
+async def main():
+    # Client and mapping store calls run in the default executor, sized for up to
+    # three concurrent branches per course (image, banner, module/step). Installed
+    # before the first to_thread so the loop never creates a default pool of its own.
+    asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=config.SYNC_CONCURRENCY * 3))
+    logger.info("Starting LearningBox to Rise Up Sync Process...")
     try:
         config.validate_config()
         lb_client = LearningBoxClient()
         riseup_client = RiseUpClient()
         webhook_url = config.get_full_webhook_url()
-        print(f"Using Webhook URL: {webhook_url}")
+        logger.info("Using Webhook URL: %s", webhook_url)
     except (ValueError, RequestException, ConnectionError) as e:
-        print(f"Initialization Error: {e}")
+        logger.error("Initialization Error: %s", e)
         return
 
     # Load existing mapping to potentially skip already processed courses
     # or re-request SCORM if needed (logic TBD based on requirements)
-    existing_mapping = mapping_store.load_mapping()
-    print(f"Loaded {len(existing_mapping)} existing mappings.")
+    existing_mapping = await asyncio.to_thread(mapping_store.load_mapping)
+    logger.info("Loaded %d existing mappings.", len(existing_mapping))
 
-    lb_catalog = lb_client.get_catalog()
+    lb_catalog = await asyncio.to_thread(lb_client.get_catalog)
     if not lb_catalog:
-        print("No courses found in Learning Box catalog or failed to fetch. Exiting.")
+        logger.warning("No courses found in Learning Box catalog or failed to fetch. Exiting.")
         return
 
-    print(f"Found {len(lb_catalog)} courses in Learning Box catalog.")
+    logger.info("Found %d courses in Learning Box catalog.", len(lb_catalog))
 
     success_count = 0
     fail_count = 0
     skip_count = 0
 
+    # --- Filter out courses without an ID or already mapped --- #
+    # Basic check: skip if mapping exists. Add more complex logic if needed
+    # (e.g., check modification dates, allow force refresh).
+    mapped_ids = frozenset(existing_mapping) # Mapping keys are int course IDs
+    todo = []
     for lb_course in lb_catalog:
         lb_id = lb_course.get('id')
         if not lb_id:
-            print(f"Skipping course due to missing ID: {lb_course.get('name', '[No Name]')}")
+            logger.warning("Skipping course due to missing ID: %s", lb_course.get('name', '[No Name]'))
             fail_count += 1
-            continue
-
-        # --- Check if already mapped --- #
-        # Basic check: skip if mapping exists. Add more complex logic if needed
-        # (e.g., check modification dates, allow force refresh).
-        if str(lb_id) in existing_mapping:
-            print(f"Skipping LB Course ID {lb_id} ('{lb_course.get('name')}') - already mapped.")
+        elif int(lb_id) in mapped_ids:
             skip_count += 1
-            continue # Skip to the next course
-        # --- End Check --- #
-
-        # Create RiseUp Structure
-        riseup_step_id = sync_course_structure(lb_course, riseup_client)
+        else:
+            todo.append(lb_course)
+    if skip_count:
+        logger.info("Skipping %d LB courses - already mapped.", skip_count)
+    # --- End Filter --- #
 
-        if riseup_step_id:
-            # Store the mapping
-            mapping_store.add_or_update_mapping(lb_id, riseup_step_id)
+    # The work is I/O-bound: sync up to SYNC_CONCURRENCY courses at once.
+    sem = asyncio.Semaphore(config.SYNC_CONCURRENCY)
+    tasks = [sync_course(lb_course, riseup_client, sem) for lb_course in todo]
+    results = await asyncio.gather(*tasks)
+    pending_exports = [lb_id for lb_id, riseup_step_id in results if riseup_step_id]
+    fail_count += len(results) - len(pending_exports)
 
-            # Request SCORM Export
-            export_result = lb_client.request_scorm_export(lb_id, webhook_url)
-            if export_result is not None: # Assuming None indicates failure
-                print(f"  Successfully requested SCORM export for LB ID {lb_id}. Waiting for webhook.")
-                success_count += 1
-            else:
-                print(f"  Failed to request SCORM export for LB ID {lb_id}. Mapping was saved, but check LearningBox.")
-                fail_count += 1
-                # Consider cleanup or retry logic here?
+    # Request all SCORM exports in one go once the structures exist. Learning Box
+    # has no multi-course export endpoint, so the calls are fanned out in parallel.
+    export_results = await asyncio.to_thread(
+        lb_client.bulk_request_scorm_exports, pending_exports, webhook_url, max_workers=config.SYNC_CONCURRENCY
+    )
+    for lb_id, export_result in zip(pending_exports, export_results):
+        if export_result is not None: # Assuming None indicates failure
+            logger.info("  Successfully requested SCORM export for LB ID %s. Waiting for webhook.", lb_id)
+            success_count += 1
         else:
-            print(f"Failed to create RiseUp structure for LB ID {lb_id}. See previous errors.")
+            logger.error("  Failed to request SCORM export for LB ID %s. Mapping was saved, but check LearningBox.", lb_id)
             fail_count += 1
+            # Consider cleanup or retry logic here?
 
-        # Optional: Add delay between requests to respect API rate limits if necessary
-        # time.sleep(1) # e.g., sleep 1 second
+    logger.info("--- Sync Process Complete ---")
+    logger.info("Successfully processed (structure created & SCORM requested): %d", success_count)
+    logger.info("Skipped (already mapped): %d", skip_count)
+    logger.info("Failed: %d", fail_count)
+    logger.info("Ensure the webhook handler is running to receive and upload SCORM packages.")
 
-    print("\n--- Sync Process Complete ---")
-    print(f"Successfully processed (structure created & SCORM requested): {success_count}")
-    print(f"Skipped (already mapped): {skip_count}")
-    print(f"Failed: {fail_count}")
-    print("Ensure the webhook handler is running to receive and upload SCORM packages.")
+def start_log_listener(level=logging.INFO):
+    """Routes log records through a queue to a console handler on its own thread; stop() the returned listener."""
+    # Worker threads then only enqueue records and never wait on each other for stdout
+    log_queue = queue.SimpleQueue()
+    console = logging.StreamHandler()
+    console.setFormatter(logging.Formatter("%(message)s"))
+    root = logging.getLogger()
+    root.setLevel(level)
+    root.addHandler(QueueHandler(log_queue))
+    listener = QueueListener(log_queue, console)
+    listener.start()
+    return listener
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    log_listener = start_log_listener()
+    try:
+        asyncio.run(main())
+    finally:
+        log_listener.stop()